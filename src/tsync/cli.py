@@ -25,31 +25,45 @@ Usage:
     tsync edit
 """
 
-import argparse
-import difflib
+import atexit
+import json
 import os
-import subprocess
+import shlex
 import sys
-import tarfile
-import tempfile
 import time
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
+from functools import cache, lru_cache, partial
 from hashlib import md5
 from pathlib import Path
+from typing import TYPE_CHECKING
+
+try:
+    from hashlib import file_digest
+except ImportError:  # Python < 3.11
+    file_digest = None
 
-import magic
-from deepdiff import DeepDiff
 from rich import print
 from rich.pretty import pprint
-from ruamel.yaml import YAML
 
-yaml = YAML(typ='safe')
+if TYPE_CHECKING:
+    import argparse
+    import subprocess
 
 SYNC_COMMAND = 'rsync'
 SYNC_ARGS_BASE = ('-avzhPr',)
+SSH_CONTROL_PERSIST = 60
+# Socket paths are limited to 104 bytes on macOS (108 on Linux)
+SSH_SOCKET_PATH_MAX = 104
+MAX_PARALLEL_PUSHES = 8
+HASH_BUFSIZE = 1 << 20
+CONFIG_CACHE_FILE = 'configs.json'
+TEXT_SUFFIXES = frozenset({'.txt', '.csv', '.json', '.yaml', '.yml', '.md', '.py', '.rs', '.c', '.h'})
+TEXT_MIME_TYPES = frozenset({'text/plain', 'text/csv', 'application/json'})
 
 
-@dataclass
+@dataclass(slots=True)
 class Config:
     remotes: dict[str, str] = field(default_factory=dict)
     files: list[str] = field(default_factory=list)
@@ -62,23 +76,80 @@ class Config:
     delete_excluded: bool = False
 
     def update(self, in_dict):
-        for key in self.__dataclass_fields__:
-            if not in_dict.get(key):
-                continue
-            self.__dict__[key] = in_dict.get(key)
+        for key, value in in_dict.items():
+            if value and key in _CONFIG_FIELDS:
+                setattr(self, key, value)
 
 
-def findup(name: str, path: Path) -> Path | None:
-    """Find the nearest parent directory containing a file with the given name."""
-    while str(path) != '/':
-        files = [p.name for p in path.glob('*') if p.is_file()]
-        if name in files:
+_CONFIG_FIELDS = frozenset(Config.__dataclass_fields__)
+
+
+@lru_cache(maxsize=256)
+def _findup_cached(name: str, start: str) -> str | None:
+    """Walk up from the absolute directory start looking for name, stopping below the filesystem root."""
+    path, parent = start, os.path.dirname(start)
+    while path != parent:
+        if os.path.isfile(os.path.join(path, name)):
             return path
-        path = path.parent
+        path, parent = parent, os.path.dirname(parent)
     return None
 
 
-def find_and_parse(filename: str = ".tsync.yaml", parser=yaml.load):
+def findup(name: str, path: Path) -> Path | None:
+    """
+    Find the nearest parent directory containing a file with the given name.
+
+    Results are memoized per process; call _findup_cached.cache_clear() if files may have appeared.
+    """
+    found = _findup_cached(name, os.path.abspath(path))
+    return None if found is None else Path(found)
+
+
+@cache
+def _yaml():
+    """Return a shared safe YAML loader, importing ruamel.yaml on first use."""
+    from ruamel.yaml import YAML
+    return YAML(typ='safe')
+
+
+def load_yaml(path: Path):
+    """Parse a YAML file."""
+    return _yaml().load(path)
+
+
+def load_config_file(path: Path):
+    """
+    Parse a YAML config file, reusing the cached result while the file is unchanged.
+
+    Parsed configs are cached as JSON keyed by absolute path, size and mtime, so
+    repeated invocations skip importing and running the YAML parser.
+    """
+    cache_path = cache_dir() / CONFIG_CACHE_FILE
+    key = str(Path(path).resolve())
+    stat = os.stat(path)
+    cache = _load_json_cache(cache_path)
+    entry = cache.get(key)
+    if entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+        return entry['data']
+
+    data = load_yaml(path)
+    # JSON turns non-string keys into strings and cannot hold values such as YAML dates,
+    # so only cache configs that come back unchanged; the rest are parsed on every run
+    try:
+        cacheable = json.loads(json.dumps(data)) == data
+    except (TypeError, ValueError):
+        cacheable = False
+    if cacheable:
+        cache[key] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'data': data}
+        try:
+            _save_json_cache(cache, cache_path)
+        except OSError:
+            # Unwritable cache dir: just skip caching
+            pass
+    return data
+
+
+def find_and_parse(filename: str = ".tsync.yaml", parser=load_config_file):
     """Find and parse the nearest .tsync.yaml config file."""
     cwd = Path().resolve()
     root = findup(filename, cwd)
@@ -88,24 +159,43 @@ def find_and_parse(filename: str = ".tsync.yaml", parser=yaml.load):
     return None, {}
 
 
-def find_files(target_dir: str = '.', ignore_files: list = None, ignore_dirs: list = None) -> list[Path]:
-    """Recursively find all files in target_dir, excluding specified files and directories."""
-    if ignore_files is None:
-        ignore_files = []
-    if ignore_dirs is None:
-        ignore_dirs = ['.git']
-
-    files = [p for p in Path(target_dir).rglob('*') if p.is_file()]
+# Default ignore sets for find_files and get_file_hashes, shared instead of rebuilt per call
+_NO_IGNORES: frozenset[str] = frozenset()
+_DEFAULT_IGNORE_DIRS = frozenset({'.git'})
 
-    # Filter out files in ignored directories (check by directory name)
-    for ignore_dir in ignore_dirs:
-        files = [f for f in files if ignore_dir not in [p.name for p in f.parents]]
 
-    # Filter out ignored files (check by filename)
-    for ignore_file in ignore_files:
-        files = [f for f in files if f.name != ignore_file]
+def _iter_files(target_dir: str, ignore_files: frozenset[str], ignore_dirs: frozenset[str]):
+    """
+    Yield (DirEntry, POSIX path relative to target_dir) for every file below target_dir, in a single walk.
 
-    return files
+    Uses os.scandir, whose entries carry the file type from the directory listing, so telling
+    files from directories needs no extra stat call. Ignored directories are never opened.
+    """
+    # An explicit stack avoids recursion limits and re-yielding each file through every nesting level
+    stack = [(target_dir, '')]
+    while stack:
+        dirpath, prefix = stack.pop()
+        try:
+            entries = os.scandir(dirpath)
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name not in ignore_dirs:
+                        stack.append((entry.path, prefix + entry.name + '/'))
+                # Skip broken symlinks and special files, which cannot be hashed
+                elif entry.name not in ignore_files and entry.is_file():
+                    yield entry, prefix + entry.name
+
+
+def find_files(target_dir: str = '.', ignore_files: list = None, ignore_dirs: list = None) -> Iterator[Path]:
+    """Recursively yield all files in target_dir as the walk finds them, excluding specified files and directories."""
+    ignore_files = _NO_IGNORES if ignore_files is None else frozenset(ignore_files)
+    ignore_dirs = _DEFAULT_IGNORE_DIRS if ignore_dirs is None else frozenset(ignore_dirs)
+
+    for entry, _ in _iter_files(target_dir, ignore_files, ignore_dirs):
+        yield Path(entry.path)
 
 
 def resolve_remote(remotestr: str) -> str:
@@ -119,77 +209,240 @@ def resolve_remote(remotestr: str) -> str:
     return remotestr
 
 
+def _advise_sequential(fd: int) -> None:
+    """Tell the kernel fd will be read front to back, so it reads ahead more aggressively."""
+    # posix_fadvise is missing on macOS and Windows, where the hint is simply skipped
+    if fadvise := getattr(os, 'posix_fadvise', None):
+        try:
+            fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        except OSError:
+            pass
+
+
+def hash_file(path: str | Path) -> str:
+    """Compute the MD5 hash of a file without reading it into memory at once."""
+    with open(path, 'rb', buffering=0) as fp:
+        _advise_sequential(fp.fileno())
+        if file_digest is not None:
+            return file_digest(fp, md5).hexdigest()
+
+        file_hash = md5()
+        buf = bytearray(HASH_BUFSIZE)
+        view = memoryview(buf)
+        while n := fp.readinto(buf):
+            file_hash.update(view[:n])
+    return file_hash.hexdigest()
+
+
+def cache_dir() -> Path:
+    """Return the directory tsync keeps its caches in."""
+    return Path(os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache') / 'tsync'
+
+
+def _load_json_cache(path: Path) -> dict:
+    """Load a JSON cache file, returning an empty cache if it is missing or unreadable."""
+    try:
+        with open(path) as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_json_cache(cache: dict, path: Path):
+    """Atomically write a JSON cache file."""
+    contents = json.dumps(cache)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, 'w') as fp:
+        fp.write(contents)
+    os.replace(tmp_path, path)
+
+
+def _hash_one(entry: tuple[str, str]) -> tuple[str, str]:
+    """Hash a single (path, relpath) entry, returning (relpath, digest)."""
+    path, relpath = entry
+    return relpath, hash_file(path)
+
+
+def _hash_workers() -> int:
+    """Return the number of hashing threads: the CPUs this process may run on, not all CPUs in the machine."""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def _walk_and_hash(directory: str, ignore_files: frozenset[str], ignore_dirs: frozenset[str]):
+    """Walk directory and yield (relpath, digest) for each file, hashing the largest files first."""
+    # DirEntry.stat() costs one syscall per file
+    files = [(entry.path, relpath, entry.stat().st_size)
+             for entry, relpath in _iter_files(directory, ignore_files, ignore_dirs)]
+    # Largest first, so a big file picked up last cannot leave one thread hashing alone at the end
+    files.sort(key=lambda file: file[2], reverse=True)
+    # hashlib releases the GIL while hashing, so threads overlap both I/O and hashing
+    with ThreadPoolExecutor(max_workers=_hash_workers()) as executor:
+        yield from executor.map(_hash_one, ((path, relpath) for path, relpath, _ in files))
+
+
 def get_file_hashes(directory: str) -> dict[str, str]:
     """Compute MD5 hashes for all files in directory."""
-    files = find_files(directory)
-    hashes = {}
-    for ifile in files:
-        with open(ifile, 'rb') as fp:
-            file_hash = md5(fp.read()).hexdigest()
-            relpath = Path(ifile).relative_to(directory)
-            hashes[relpath.as_posix()] = file_hash
-    return hashes
+    return dict(_walk_and_hash(directory, _NO_IGNORES, _DEFAULT_IGNORE_DIRS))
+
+
+def _read_tar_members(path: Path, names: set[str]) -> dict[str, bytes]:
+    """Read the named regular-file members of a gzipped tarball into memory."""
+    import tarfile
+
+    with tarfile.open(path, 'r:gz') as tar:
+        return {m.name: tar.extractfile(m).read() for m in tar.getmembers() if m.isfile() and m.name in names}
+
+
+def _changed_source(base: Path, members: dict[str, bytes] | None, name: str) -> bytes | Path | None:
+    """Return a tarball member's contents or the file's path under the base directory, or None if missing."""
+    if members is not None:
+        return members.get(name)
+    path = base / name
+    return path if path.is_file() else None
+
+
+def show_text_diffs(changed: list[str], path1: Path, path2: Path):
+    """Show line diffs for changed text files that exist under both path1 and path2."""
+    import difflib
+
+    import magic
+
+    # Gzipped tarballs are read in memory rather than extracted to disk
+    names = set(changed)
+    members1 = _read_tar_members(path1, names) if path1.is_file() and path1.suffix == '.gz' else None
+    members2 = _read_tar_members(path2, names) if path2.is_file() and path2.suffix == '.gz' else None
+
+    mime = None
+
+    for changed_file in changed:
+        old = _changed_source(path1, members1, changed_file)
+        new = _changed_source(path2, members2, changed_file)
+        if old is None or new is None:
+            continue
+        # Known text suffixes skip libmagic; anything else is sniffed by content, which for files
+        # on disk reads only their header, so binaries are skipped without being loaded
+        is_text = os.path.splitext(changed_file)[1].lower() in TEXT_SUFFIXES
+        if not is_text:
+            mime = mime or magic.Magic(mime=True)
+            if isinstance(old, Path):
+                is_text = mime.from_file(str(old)) in TEXT_MIME_TYPES
+            else:
+                is_text = mime.from_buffer(old) in TEXT_MIME_TYPES
+        if is_text:
+            old = old.read_bytes() if isinstance(old, Path) else old
+            new = new.read_bytes() if isinstance(new, Path) else new
+            # Suffix-matched files may use another encoding; show undecodable bytes rather than fail
+            oldfile = old.decode(errors='replace').splitlines()
+            newfile = new.decode(errors='replace').splitlines()
+            for line in difflib.unified_diff(
+                oldfile, newfile,
+                fromfile=str(path1 / changed_file),
+                tofile=str(path2 / changed_file),
+                n=0
+            ):
+                if line.startswith('-'):
+                    print('[red]' + line)
+                elif line.startswith('+'):
+                    print('[green]' + line)
 
 
 def show_diff(state1: dict, state2: dict, path1: Path = None, path2: Path = None):
     """Display differences between two file hash states with detailed diffs for text files."""
-    diff = DeepDiff(state1, state2)
-    if not diff:
+    added = [key for key in state2 if key not in state1]
+    removed = [key for key in state1 if key not in state2]
+    changed = [key for key in state1 if key in state2 and state1[key] != state2[key]]
+    if not (added or removed or changed):
         print("Clean!")
         return
 
-    if 'dictionary_item_added' in diff:
-        added = [x[6:-2] for x in diff['dictionary_item_added']]
+    if added:
         print("[green]ADDED[/green]:", *added)
 
-    if 'dictionary_item_removed' in diff:
-        removed = [x[6:-2] for x in diff['dictionary_item_removed']]
+    if removed:
         print("[red]REMOVED[/red]:", *removed)
 
-    if 'values_changed' in diff:
-        changed = {x[6:-2]: diff['values_changed'][x] for x in diff['values_changed']}
+    if changed:
         print("[yellow]CHANGED[/yellow]:", *changed)
 
-        # Handle gzip archives
-        if path1 and path1.is_file() and path1.suffix == '.gz':
-            with tarfile.open(path1, 'r:gz') as tar:
-                tar.extractall(Path('/tmp') / "path1", members=[x for x in tar.getmembers() if x.name in changed])
-            path1 = Path("/tmp/path1")
-
-        if path2 and path2.is_file() and path2.suffix == '.gz':
-            with tarfile.open(path2, 'r:gz') as tar:
-                tar.extractall(Path('/tmp') / "path2", members=[x for x in tar.getmembers() if x.name in changed])
-            path2 = Path("/tmp/path2")
-
-        # Show detailed diff for text files
         if path1 and path2:
-            mime = magic.Magic(mime=True)
-            allowed_types = ['text/plain', 'text/csv', 'application/json']
-
-            for changed_file in changed:
-                mimetype = mime.from_file(str(path1 / changed_file))
-                if mimetype in allowed_types:
-                    with open(path1 / changed_file, 'r') as fp:
-                        oldfile = fp.read().split('\n')
-                    with open(path2 / changed_file, 'r') as fp:
-                        newfile = fp.read().split('\n')
-                    out = list(difflib.unified_diff(
-                        oldfile, newfile,
-                        fromfile=str(path1 / changed_file),
-                        tofile=str(path2 / changed_file),
-                        n=0
-                    ))
-                    for line in out:
-                        if line.startswith('-'):
-                            print('[red]' + line)
-                        elif line.startswith('+'):
-                            print('[green]' + line)
+            show_text_diffs(changed, path1, path2)
 
     sys.exit(1)
 
 
-def push(files: list, targets: list, remotes: dict, root: Path, sync_args: list, mkdir: bool = False):
-    """Push files to one or more remote targets."""
+def _itemized_files(output: bytes) -> tuple[list[str], list[str]]:
+    """
+    Split rsync '--out-format=%i %f' output into (changed, new) regular files.
+
+    New files are the ones rsync would create on the receiver, itemized as '+++++++++'.
+    Directories and other non-file entries are left out.
+    """
+    changed, new = [], []
+    for line in output.splitlines():
+        item, _, name = line.partition(b' ')
+        if item[1:2] != b'f' or not name:
+            continue
+        # rsync runs without a shell, so names arrive unquoted and are used verbatim
+        (new if item[2:] == b'+' * 9 else changed).append(os.fsdecode(name))
+    return changed, new
+
+
+def _push_one(target: str, files: list, remotes: dict, relpath: Path, sync_args: list, mkdir: bool = False,
+              capture: bool = False) -> list['subprocess.CompletedProcess']:
+    """
+    Push files to a single remote target and return the commands run, rsync's last.
+
+    With capture, commands are neither echoed nor streamed; their output is kept for the caller to print.
+    """
+    run = partial(run_command, capture_output=True, echo=False) if capture else run_command
+    sync_args_local = sync_args[:]
+    if files:
+        sync_args_local.extend(files)
+    else:
+        sync_args_local.append('.')
+
+    remote_path = str(Path(remotes[target]) / relpath) + os.sep
+    sync_args_local.append(remote_path)
+
+    if mkdir:
+        mkdir_path = str(Path(remotes[target])).split(":")[-1]
+        mkdir_path = str(Path(mkdir_path) / relpath) + os.sep
+        mkdir_cmd = ['mkdir', '-p', mkdir_path]
+        if ':' in remotes[target]:
+            mkdir_cmd = ['ssh', *ssh_options(), target] + mkdir_cmd
+        commands = [run(mkdir_cmd)]
+    else:
+        commands = []
+
+    commands.append(run([SYNC_COMMAND] + sync_args_local))
+    return commands
+
+
+def _print_captured(target: str, commands: list['subprocess.CompletedProcess']):
+    """Print the commands run for target and their captured output, as run_command would have."""
+    print(f"[bold]{target}[/bold]:")
+    for result in commands:
+        print(result.args)
+        if result.stdout:
+            sys.stdout.write(result.stdout)
+        if result.stderr:
+            sys.stderr.write(result.stderr)
+
+
+def push(files: list, targets: list, remotes: dict, root: Path, relpath: Path, sync_args: list,
+         mkdir: bool = False) -> int:
+    """
+    Push files to one or more remote targets.
+
+    relpath is the current directory relative to root, mirrored below each remote's root.
+    Targets are independent, so they are pushed in parallel. With more than one target, each
+    push's output is captured and printed per target, in target order, so concurrent rsync
+    progress does not interleave. Returns the exit status of the first failed push in target
+    order, or 0 if all succeeded.
+    """
     sync_args = list(sync_args) + ['--relative']
     if targets == ['all']:
         targets = list(remotes.keys())
@@ -198,30 +451,27 @@ def push(files: list, targets: list, remotes: dict, root: Path, sync_args: list,
         if target not in remotes:
             raise RuntimeError(f"Remote {target} not found. Please check {root}/.tsync.yaml")
 
-        sync_args_local = sync_args[:]
-        if files:
-            sync_args_local.extend(files)
-        else:
-            sync_args_local.append('.')
-
-        remote_path = str(Path(remotes[target]) / Path('.').resolve().relative_to(str(root))) + os.sep
-        sync_args_local.append(remote_path)
-
-        if mkdir:
-            mkdir_path = str(Path(remotes[target])).split(":")[-1]
-            mkdir_path = str(Path(mkdir_path) / Path(".").resolve().relative_to(str(root))) + os.sep
-            mkdir_cmd = f'mkdir -p {mkdir_path}'
-            if ':' in remotes[target]:
-                mkdir_cmd = f'ssh {target} {mkdir_cmd}'
-            run_command(mkdir_cmd.split())
+    capture = len(targets) > 1
+    push_one = partial(_push_one, files=files, remotes=remotes, relpath=relpath, sync_args=sync_args, mkdir=mkdir,
+                       capture=capture)
+    returncodes = []
+    with ThreadPoolExecutor(max_workers=min(len(targets), MAX_PARALLEL_PUSHES) or 1) as executor:
+        # map yields in target order, so each target's output is printed as soon as it and all before it finish
+        for target, commands in zip(targets, executor.map(push_one, targets)):
+            if capture:
+                _print_captured(target, commands)
+            returncodes.append(commands[-1].returncode)
+    return next((code for code in returncodes if code), 0)
 
-        run_command([SYNC_COMMAND] + sync_args_local)
 
+def pull(files: list, source: str, remotes: dict, relpath: Path, sync_args: list) -> int:
+    """
+    Pull files from a remote source, relpath being the current directory relative to the config root.
 
-def pull(files: list, source: str, remotes: dict, root: Path, sync_args: list):
-    """Pull files from a remote source."""
+    Returns rsync's exit status, or 0 if source is not a known remote and nothing was run.
+    """
     if source not in remotes:
-        return
+        return 0
 
     sync_args_local = list(sync_args)
     if files:
@@ -229,38 +479,121 @@ def pull(files: list, source: str, remotes: dict, root: Path, sync_args: list):
         for file in files:
             # The additional dot ensures directory structure relative to current directory
             sync_args_local.append(
-                str(Path(remotes[source]).as_posix() / Path('.').resolve().relative_to(str(root))) + '/./' + file
+                str(Path(remotes[source]).as_posix() / relpath) + '/./' + file
             )
     else:
-        sync_args_local.append(str(Path(remotes[source]) / Path('.').resolve().relative_to(str(root))) + os.sep)
+        sync_args_local.append(str(Path(remotes[source]) / relpath) + os.sep)
 
     sync_args_local.append('.')
-    run_command([SYNC_COMMAND] + sync_args_local)
+    return run_command([SYNC_COMMAND] + sync_args_local).returncode
+
 
+def _write_patterns(patterns: list[str]) -> str:
+    """Write rsync filter patterns to a temporary file that is removed at exit, and return its path."""
+    import tempfile
 
-def run_command(cmdlist: list[str], capture_output: bool = False) -> subprocess.CompletedProcess:
-    """Execute a command and return the result."""
-    print(cmdlist)
-    return subprocess.run(cmdlist, capture_output=capture_output, text=True)
+    # rsync reads lines starting with '#' or ';' as comments, so that character becomes a bracket class
+    # YAML may parse patterns such as 404 as numbers
+    patterns = [str(pattern) for pattern in patterns]
+    lines = (f'[{pattern[0]}]{pattern[1:]}' if pattern[:1] in ('#', ';') else pattern for pattern in patterns)
+    with tempfile.NamedTemporaryFile('w', prefix='tsync-', suffix='.patterns', delete=False) as fp:
+        fp.write('\n'.join(lines) + '\n')
+    atexit.register(Path(fp.name).unlink, missing_ok=True)
+    return fp.name
 
 
-def run_ssh_command(remote: str, command: str, directory: str) -> subprocess.CompletedProcess:
+def filter_args(includes: list[str], excludes: list[str]) -> list[str]:
+    """Return rsync arguments applying the include and exclude patterns, read from pattern files."""
+    args = []
+    # Include must come before exclude for rsync
+    if includes:
+        args.append(f"--include-from={_write_patterns(includes)}")
+    if excludes:
+        args.append(f"--exclude-from={_write_patterns(excludes)}")
+    return args
+
+
+def run_command(cmdlist: list[str], capture_output: bool = False, text: bool = True,
+                echo: bool = True) -> 'subprocess.CompletedProcess':
+    """Execute a command and return the result, with captured output decoded unless text is False."""
+    import subprocess
+
+    if echo:
+        print(cmdlist)
+    return subprocess.run(cmdlist, capture_output=capture_output, text=text)
+
+
+@cache
+def ssh_options() -> tuple[str, ...]:
+    """
+    Return ssh options that multiplex connections to the same host over one master connection.
+
+    The master lingers for SSH_CONTROL_PERSIST seconds, so the mkdir preflight, rsync
+    passes and follow-up invocations skip the SSH handshake. Returns no options, and so plain
+    connections, if the socket directory cannot be created or the socket path would be too long.
+    """
+    control_path = f'{Path.home() / ".ssh"}/cm-%C'
+    # %C expands to 40 hex digits and OpenSSH appends a 17 character suffix while creating the socket
+    if len(control_path) - 2 + 40 + 17 >= SSH_SOCKET_PATH_MAX:
+        return ()
+    try:
+        Path(control_path).parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+    except OSError:
+        return ()
+    return (
+        '-o', 'ControlMaster=auto',
+        '-o', f'ControlPath={control_path}',
+        '-o', f'ControlPersist={SSH_CONTROL_PERSIST}',
+    )
+
+
+def rsync_ssh_args() -> list[str]:
+    """Return rsync arguments that make it connect through ssh with ssh_options(), if there are any."""
+    if not (options := ssh_options()):
+        return []
+    return ['-e', ' '.join(['ssh', *map(shlex.quote, options)])]
+
+
+def run_ssh_command(remote: str, command: str, directory: str) -> 'subprocess.CompletedProcess':
     """Execute a command on a remote host via SSH."""
-    cmd = ['ssh', remote, f"cd {Path(directory).as_posix()} && {command}"]
+    cmd = ['ssh', *ssh_options(), remote, f"cd {Path(directory).as_posix()} && {command}"]
     return run_command(cmd)
 
 
-def parse_args():
-    """Parse command line arguments."""
+def _add_global_options(parser: 'argparse.ArgumentParser', default):
+    """Add the options accepted both before and after the subcommand."""
+    parser.add_argument('-ne', '--no-excludes', action='store_true', default=default, help='Ignore excludes')
+    parser.add_argument("-y", "--no-confirm", action='store_true', default=default,
+                        help="Don't prompt before syncing")
+    parser.add_argument("-d", "--dry-run", action='store_true', default=default,
+                        help="Show commands without executing")
+    parser.add_argument("-m", "--mkdir", action='store_true', default=default,
+                        help="Create directories before sync")
+    parser.add_argument("--delete", action='store_true', default=default,
+                        help="Delete extraneous files on receiver (directories only)")
+    parser.add_argument("--delete-excluded", action='store_true', default=default,
+                        help="Also delete excluded files")
+
+
+@cache
+def _build_parser():
+    """Build the argument parser once; argparse is only imported when the CLI parses arguments."""
+    import argparse
+
     ap = argparse.ArgumentParser(
         prog='tsync',
         description='rsync wrapper for syncing files with push/pull workflow'
     )
 
+    # Subcommands accept the global options too, so they can go before or after the subcommand
+    # in a single parsing pass. SUPPRESS keeps an absent flag from clobbering one given earlier.
+    global_options = argparse.ArgumentParser(add_help=False)
+    _add_global_options(global_options, default=argparse.SUPPRESS)
+
     subparsers = ap.add_subparsers(dest='mode')
 
     # Push subcommand
-    sub_push = subparsers.add_parser('push', help='Push to one or more remotes')
+    sub_push = subparsers.add_parser('push', help='Push to one or more remotes', parents=[global_options])
     sub_push.add_argument('target', nargs='*', help="Target remote(s)")
     sub_push.add_argument('-f', '--files', nargs='*', help='Files or directories to sync')
     sub_push.add_argument('-e', '--excludes', nargs='*', action='extend', default=[], help='Exclude PATTERN')
@@ -268,7 +601,7 @@ def parse_args():
                           help='Include PATTERN (overrides excludes)')
 
     # Pull subcommand
-    sub_pull = subparsers.add_parser('pull', help='Pull from a remote')
+    sub_pull = subparsers.add_parser('pull', help='Pull from a remote', parents=[global_options])
     sub_pull.add_argument('source', nargs='?', help="Source remote")
     sub_pull.add_argument('-f', '--files', nargs='*', help='Files or directories to sync')
     sub_pull.add_argument('-e', '--excludes', nargs='*', action='extend', default=[], help='Exclude PATTERN')
@@ -276,41 +609,38 @@ def parse_args():
                           help='Include PATTERN (overrides excludes)')
 
     # Cmd subcommand
-    sub_cmd = subparsers.add_parser('cmd', help='Run command on remote in corresponding directory')
+    sub_cmd = subparsers.add_parser('cmd', help='Run command on remote in corresponding directory',
+                                    parents=[global_options])
     sub_cmd.add_argument('command', nargs='*', help='Command to execute')
     sub_cmd.add_argument('--target', nargs='*', help='Target remote(s)')
 
     # Diff subcommand
-    sub_diff = subparsers.add_parser('diff', help='Show differences with remote')
+    sub_diff = subparsers.add_parser('diff', help='Show differences with remote', parents=[global_options])
     sub_diff.add_argument('remote', help="Remote to compare with")
     sub_diff.add_argument('--copy', action='store_true',
                           help="Copy remote files to temp directory and show detailed diff")
 
     # Edit subcommand
-    subparsers.add_parser('edit', help='Edit nearest .tsync.yaml config')
+    subparsers.add_parser('edit', help='Edit nearest .tsync.yaml config', parents=[global_options])
 
     # Global options
-    ap.add_argument('-ne', '--no-excludes', action='store_true', default=False, help='Ignore excludes')
-    ap.add_argument("-y", "--no-confirm", action='store_true', help="Don't prompt before syncing")
-    ap.add_argument("-d", "--dry-run", action='store_true', help="Show commands without executing")
-    ap.add_argument("-m", "--mkdir", action='store_true', help="Create directories before sync")
-    ap.add_argument("--delete", action='store_true',
-                    help="Delete extraneous files on receiver (directories only)")
-    ap.add_argument("--delete-excluded", action='store_true', help="Also delete excluded files")
-
-    # Multi-pass parsing for flexible argument ordering
-    args, extra_args_list = ap.parse_known_args()
-    args, extra_args_list = ap.parse_known_args(extra_args_list, args)
+    _add_global_options(ap, default=False)
+    return ap
+
+
+def parse_args(argv: list[str] | None = None):
+    """Parse command line arguments, from sys.argv unless argv is given."""
+    args, extra_args_list = _build_parser().parse_known_args(argv)
     return args, extra_args_list
 
 
-def main():
-    """Main entry point."""
-    args, extra_args_list = parse_args()
+def main(argv: list[str] | None = None) -> int:
+    """Main entry point. Returns the exit status, so the CLI can also be run in-process."""
+    args, extra_args_list = parse_args(argv)
     config = Config()
 
     root = None
-    root_yaml, config_yaml = find_and_parse('.tsync.yaml', yaml.load)
+    root_yaml, config_yaml = find_and_parse('.tsync.yaml')
     if config_yaml:
         config.update(config_yaml)
         root = root_yaml
@@ -327,12 +657,17 @@ def main():
     if root:
         pprint(config, expand_all=True)
     else:
-        return
+        return 0
 
     if not config.mode:
-        return
+        return 0
 
-    sync_args = list(SYNC_ARGS_BASE)
+    # Current directory relative to the config root, mirrored below each remote's root
+    relpath = Path('.').resolve().relative_to(root)
+
+    # Only remotes on other hosts go through ssh; local-only configs never touch the ssh setup
+    ssh_args = rsync_ssh_args() if any(':' in remote for remote in config.remotes.values()) else []
+    sync_args = list(SYNC_ARGS_BASE) + ssh_args
 
     if config.delete:
         sync_args.append('--delete')
@@ -343,12 +678,8 @@ def main():
     if config.dry_run:
         sync_args.append('--dry-run')
 
-    # Include must come before exclude for rsync
-    if not args.no_excludes:
-        for item in config.includes:
-            sync_args.append(f"--include={item}")
-        for item in config.excludes:
-            sync_args.append(f"--exclude={item}")
+    if not args.no_excludes and config.mode in ('push', 'pull'):
+        sync_args.extend(filter_args(config.includes, config.excludes))
 
     print(f"Unprocessed args directly passed to {SYNC_COMMAND}: {extra_args_list}")
     sync_args.extend(extra_args_list)
@@ -357,34 +688,56 @@ def main():
         assert all(t in config.remotes.keys() for t in args.target)
         warn = 'y' if args.no_confirm else input(f"PUSH to {args.target}? (y/Y/ENTER to continue)")
         if warn.lower() == 'y' or warn == '':
-            push(config.files, args.target, config.remotes, root, sync_args, mkdir=config.mkdir)
+            returncode = push(config.files, args.target, config.remotes, root, relpath, sync_args,
+                              mkdir=config.mkdir)
+            if returncode:
+                return returncode
 
     elif config.mode == 'pull' and args.source:
         assert args.source in config.remotes.keys()
         warn = 'y' if args.no_confirm else input(f"PULL from {args.source}? (y/Y/ENTER to continue)")
         if warn.lower() == 'y' or warn == '':
-            pull(config.files, args.source, config.remotes, root, sync_args)
+            returncode = pull(config.files, args.source, config.remotes, relpath, sync_args)
+            if returncode:
+                return returncode
 
     elif config.mode == 'diff':
-        remote_path = str(Path(config.remotes[args.remote]) / Path('.').resolve().relative_to(str(root))) + os.sep
+        remote_path = str(Path(config.remotes[args.remote]) / relpath) + os.sep
         if args.copy:
-            sync_args_pass1 = ['-ar', '--dry-run', '--checksum', '--out-format="%f"', '.', remote_path]
-            with tempfile.TemporaryDirectory() as tempdir:
-                out = run_command([SYNC_COMMAND] + sync_args_pass1, capture_output=True)
-                changed_files = filter(None, out.stdout.replace('"', '').split('\n'))
-                changed_files = list(filter(lambda x: x != '.', changed_files))
-                changed_files = [remote_path + f for f in changed_files]
-                print(changed_files)
-                if changed_files:
-                    run_command([SYNC_COMMAND, '-avzhPrc'] + changed_files + [tempdir])
-                    remote_hashes = get_file_hashes(tempdir)
-                    local_hashes = get_file_hashes('.')
-                    print(remote_hashes)
-                    print(local_hashes)
-                    show_diff(local_hashes, remote_hashes, path1=Path('.'), path2=Path(tempdir))
+            import tempfile
+
+            sync_args_pass1 = ['-ar', *ssh_args, '--dry-run', '--checksum', '--out-format=%i %f', '.', remote_path]
+            out = run_command([SYNC_COMMAND] + sync_args_pass1, capture_output=True, text=False)
+            if out.returncode:
+                # An empty listing from a failed run says nothing about the tree, so report why instead
+                sys.stderr.write(os.fsdecode(out.stderr))
+                return out.returncode
+            changed_files, local_only = _itemized_files(out.stdout)
+            if not (changed_files or local_only):
+                print("Clean!")
+                return 0
+            if local_only:
+                print("[green]LOCAL ONLY[/green]:", *local_only)
+            if changed_files:
+                print("[yellow]CHANGED[/yellow]:", *changed_files)
+                with tempfile.TemporaryDirectory() as tempdir:
+                    # rsync already compared checksums, so only fetch the changed files for a content diff.
+                    # The '/./' marker makes --relative recreate their paths below tempdir.
+                    fetched = run_command([SYNC_COMMAND, '-avzhPrc', *ssh_args, '--relative']
+                                          + [remote_path + './' + f for f in changed_files] + [tempdir])
+                    if fetched.returncode:
+                        return fetched.returncode
+                    show_text_diffs(changed_files, Path('.'), Path(tempdir))
+            return 1
         else:
-            run_command([SYNC_COMMAND, '-arnci', '.', remote_path])
-            run_command([SYNC_COMMAND, '-arnci', remote_path, '.'])
+            passes = ([SYNC_COMMAND, '-arnci', *ssh_args, '.', remote_path],
+                      [SYNC_COMMAND, '-arnci', *ssh_args, remote_path, '.'])
+            # Both dry runs are independent, so overlap their remote round trips and print results in order
+            with ThreadPoolExecutor(max_workers=len(passes)) as executor:
+                results = list(executor.map(partial(run_command, capture_output=True), passes))
+            for result in results:
+                sys.stdout.write(result.stdout)
+                sys.stderr.write(result.stderr)
 
     elif config.mode == 'edit':
         editor = os.environ.get('EDITOR', 'vi')
@@ -396,15 +749,17 @@ def main():
     elif config.mode == 'cmd':
         assert all(t in config.remotes.keys() for t in args.target)
         for target in args.target:
-            remotedir = str(Path(config.remotes[target]) / Path('.').resolve().relative_to(str(root))) + os.sep
+            remotedir = str(Path(config.remotes[target]) / relpath) + os.sep
             if ':' in remotedir:
                 remote, directory = remotedir.split(':')
                 res = run_ssh_command(remote, ' '.join(args.command), directory)
-                sys.exit(res.returncode)
+                return res.returncode
             else:
                 res = run_command(args.command)
-                sys.exit(res.returncode)
+                return res.returncode
+
+    return 0
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -1,19 +1,35 @@
 """Tests for tsync CLI."""
 
+import os
 import subprocess
 import sys
+import tarfile
+import tempfile
+import time
+from hashlib import md5
 from pathlib import Path
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
 
 import pytest
 
 from tsync.cli import (
+    HASH_BUFSIZE,
+    _findup_cached,
     Config,
+    filter_args,
     findup,
     find_files,
     get_file_hashes,
+    hash_file,
+    load_config_file,
+    main,
     resolve_remote,
     parse_args,
+    rsync_ssh_args,
+    push,
+    show_diff,
+    show_text_diffs,
+    ssh_options,
 )
 
 
@@ -62,6 +78,24 @@ class TestFindup:
         result = findup("nonexistent.yaml", deep)
         assert result is None
 
+    def test_ignores_directory_with_same_name(self, tmp_path: Path) -> None:
+        """Only match regular files, not directories carrying the target name."""
+        (tmp_path / "target.yaml").touch()
+        sub = tmp_path / "sub"
+        (sub / "target.yaml").mkdir(parents=True)
+        assert findup("target.yaml", sub) == tmp_path
+
+    def test_memoizes_result(self, tmp_path: Path) -> None:
+        """Reuse the previous answer for the same name and start directory."""
+        (tmp_path / "target.yaml").touch()
+        assert findup("target.yaml", tmp_path) == tmp_path
+
+        (tmp_path / "target.yaml").unlink()
+        assert findup("target.yaml", tmp_path) == tmp_path
+
+        _findup_cached.cache_clear()
+        assert findup("target.yaml", tmp_path) is None
+
 
 class TestFindFiles:
     """Tests for find_files function."""
@@ -83,7 +117,7 @@ class TestFindFiles:
         subdir.mkdir()
         (subdir / "c.txt").touch()
 
-        files = find_files(str(tmp_path))
+        files = list(find_files(str(tmp_path)))
         assert len(files) == 3
 
     def test_ignores_git_by_default(self, tmp_path: Path) -> None:
@@ -126,6 +160,80 @@ class TestFindFiles:
         assert "a.txt" in filenames
         assert "module.pyc" not in filenames
 
+    def test_ignores_nested_dirs(self, tmp_path: Path) -> None:
+        """
+        Ignore directories at any depth.
+
+        Directory structure:
+            tmp_path/
+            └── sub/
+                ├── a.txt              <- found
+                └── __pycache__/
+                    └── module.pyc     <- ignored
+        """
+        cache = tmp_path / "sub" / "__pycache__"
+        cache.mkdir(parents=True)
+        (tmp_path / "sub" / "a.txt").touch()
+        (cache / "module.pyc").touch()
+
+        files = find_files(str(tmp_path), ignore_dirs=['__pycache__'])
+        assert [f.name for f in files] == ["a.txt"]
+
+    def test_never_lists_ignored_dirs(self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+        """
+        Skip ignored directories before descending, so they are never opened.
+
+        Directory structure:
+            tmp_path/
+            ├── a.txt
+            └── node_modules/  <- never scanned
+                └── pkg/
+                    └── index.js
+        """
+        (tmp_path / "a.txt").touch()
+        (tmp_path / "node_modules" / "pkg").mkdir(parents=True)
+        (tmp_path / "node_modules" / "pkg" / "index.js").touch()
+
+        scanned: list[str] = []
+        real_scandir = os.scandir
+
+        def spy(path):
+            scanned.append(os.fspath(path))
+            return real_scandir(path)
+
+        monkeypatch.setattr(os, "scandir", spy)
+        files = find_files(str(tmp_path), ignore_dirs=['node_modules'])
+        assert [f.name for f in files] == ["a.txt"]
+        assert scanned == [str(tmp_path)]
+
+    def test_skips_broken_symlinks(self, tmp_path: Path) -> None:
+        """Skip symlinks whose target does not exist."""
+        (tmp_path / "a.txt").touch()
+        (tmp_path / "dangling").symlink_to(tmp_path / "missing")
+
+        files = find_files(str(tmp_path))
+        assert [f.name for f in files] == ["a.txt"]
+
+    def test_does_not_follow_directory_symlinks(self, tmp_path: Path) -> None:
+        """
+        List symlinked files but do not descend into symlinked directories.
+
+        Directory structure:
+            tmp_path/
+            ├── real/
+            │   └── a.txt
+            ├── link.txt -> real/a.txt     <- found
+            └── linkdir -> real/           <- not descended
+        """
+        (tmp_path / "real").mkdir()
+        (tmp_path / "real" / "a.txt").touch()
+        (tmp_path / "link.txt").symlink_to(tmp_path / "real" / "a.txt")
+        (tmp_path / "linkdir").symlink_to(tmp_path / "real", target_is_directory=True)
+
+        files = find_files(str(tmp_path))
+        relpaths = sorted(f.relative_to(tmp_path).as_posix() for f in files)
+        assert relpaths == ["link.txt", "real/a.txt"]
+
     def test_ignores_specified_files(self, tmp_path: Path) -> None:
         """Ignore files by name."""
         (tmp_path / "keep.txt").touch()
@@ -170,6 +278,263 @@ class TestGetFileHashes:
         hashes: dict[str, str] = get_file_hashes(str(tmp_path))
         assert "sub/file.txt" in hashes
 
+    def test_many_files(self, tmp_path: Path) -> None:
+        """Hash every file when work is spread over several threads."""
+        for i in range(64):
+            (tmp_path / f"{i}.txt").write_text(str(i))
+
+        hashes: dict[str, str] = get_file_hashes(str(tmp_path))
+        assert hashes == {f"{i}.txt": md5(str(i).encode()).hexdigest() for i in range(64)}
+
+    def test_hashes_largest_first(self, tmp_path: Path) -> None:
+        """Hand files to the pool in descending size order, so a large file is never picked up last."""
+        for name, size in [("small", 1), ("large", 300), ("medium", 20)]:
+            (tmp_path / name).write_bytes(b"x" * size)
+
+        hashes: dict[str, str] = get_file_hashes(str(tmp_path))
+        assert list(hashes) == ["large", "medium", "small"]
+
+
+class TestLoadConfigFile:
+    """Tests for load_config_file function."""
+
+    @pytest.fixture(autouse=True)
+    def cache_home(self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+        """Point the cache directory at a temporary location."""
+        monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+        return tmp_path / "cache"
+
+    def test_parses_and_caches(self, tmp_path: Path, cache_home: Path) -> None:
+        """Parse the config and store the result in the cache directory."""
+        config = tmp_path / ".tsync.yaml"
+        config.write_text("remotes:\n  server: host:/path\n")
+
+        assert load_config_file(config) == {"remotes": {"server": "host:/path"}}
+        assert (cache_home / "tsync" / "configs.json").is_file()
+
+    def test_reuses_cached_result(self, tmp_path: Path) -> None:
+        """Skip the YAML parser while the file is unchanged."""
+        config = tmp_path / ".tsync.yaml"
+        config.write_text("remotes:\n  server: host:/path\n")
+        load_config_file(config)
+
+        with patch('tsync.cli.load_yaml') as mock_load:
+            assert load_config_file(config) == {"remotes": {"server": "host:/path"}}
+        mock_load.assert_not_called()
+
+    def test_reparses_modified_file(self, tmp_path: Path) -> None:
+        """Parse again once the file changes."""
+        config = tmp_path / ".tsync.yaml"
+        config.write_text("remotes:\n  server: host:/path\n")
+        load_config_file(config)
+
+        config.write_text("remotes:\n  server: host:/other/path\n")
+        assert load_config_file(config) == {"remotes": {"server": "host:/other/path"}}
+
+    def test_non_string_keys_are_not_cached(self, tmp_path: Path, cache_home: Path) -> None:
+        """Return the same keys on cold and warm runs when JSON could not preserve them."""
+        config = tmp_path / ".tsync.yaml"
+        config.write_text("remotes:\n  1: /tmp/x\n")
+
+        assert load_config_file(config) == {"remotes": {1: "/tmp/x"}}
+        assert load_config_file(config) == {"remotes": {1: "/tmp/x"}}
+        assert not (cache_home / "tsync" / "configs.json").exists()
+
+
+class TestHashFile:
+    """Tests for hash_file function."""
+
+    def test_empty_file(self, tmp_path: Path) -> None:
+        """Hash an empty file."""
+        (tmp_path / "empty").touch()
+        assert hash_file(tmp_path / "empty") == md5(b"").hexdigest()
+
+    def test_file_larger_than_buffer(self, tmp_path: Path) -> None:
+        """Hash a file spanning several read blocks, with a partial last block."""
+        data = bytes(range(256)) * (3 * HASH_BUFSIZE // 256) + b"tail"
+        (tmp_path / "big.bin").write_bytes(data)
+        assert hash_file(tmp_path / "big.bin") == md5(data).hexdigest()
+
+    def test_fallback_without_file_digest(self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+        """Hash with the readinto loop when hashlib.file_digest is unavailable (Python < 3.11)."""
+        monkeypatch.setattr('tsync.cli.file_digest', None)
+        data = b"x" * (HASH_BUFSIZE + 1)
+        (tmp_path / "big.bin").write_bytes(data)
+        assert hash_file(tmp_path / "big.bin") == md5(data).hexdigest()
+
+    def test_without_posix_fadvise(self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+        """Hash normally on platforms without os.posix_fadvise (macOS, Windows)."""
+        monkeypatch.delattr(os, "posix_fadvise", raising=False)
+        (tmp_path / "a.txt").write_bytes(b"hello")
+        assert hash_file(tmp_path / "a.txt") == md5(b"hello").hexdigest()
+
+
+class TestShowDiff:
+    """Tests for show_diff function."""
+
+    def test_clean(self, capsys: pytest.CaptureFixture) -> None:
+        """Report identical states as clean without exiting."""
+        show_diff({"a": "1"}, {"a": "1"})
+        assert "Clean!" in capsys.readouterr().out
+
+    def test_reports_added_removed_changed(self, capsys: pytest.CaptureFixture) -> None:
+        """List added, removed and changed keys, then exit with status 1."""
+        with pytest.raises(SystemExit) as exc:
+            show_diff({"same": "1", "gone": "2", "edit": "3"}, {"same": "1", "new": "4", "edit": "5"})
+        assert exc.value.code == 1
+        lines = capsys.readouterr().out.splitlines()
+        assert "ADDED: new" in lines
+        assert "REMOVED: gone" in lines
+        assert "CHANGED: edit" in lines
+
+
+class TestShowTextDiffs:
+    """Tests for show_text_diffs function."""
+
+    def test_shows_changed_lines(self, tmp_path: Path, capsys: pytest.CaptureFixture) -> None:
+        """
+        Print removed and added lines of changed text files.
+
+        Directory structure:
+            tmp_path/
+            ├── local/
+            │   └── sub/
+            │       └── notes.txt
+            └── remote/
+                └── sub/
+                    └── notes.txt
+        """
+        for side, text in (("local", "same\nold line\n"), ("remote", "same\nnew line\n")):
+            (tmp_path / side / "sub").mkdir(parents=True)
+            (tmp_path / side / "sub" / "notes.txt").write_text(text)
+
+        show_text_diffs(["sub/notes.txt"], tmp_path / "local", tmp_path / "remote")
+        out = capsys.readouterr().out
+        assert "-old line" in out
+        assert "+new line" in out
+
+    def test_known_suffix_skips_mime_detection(self, tmp_path: Path, capsys: pytest.CaptureFixture) -> None:
+        """Diff files with a known text suffix without consulting libmagic."""
+        (tmp_path / "local").mkdir()
+        (tmp_path / "remote").mkdir()
+        (tmp_path / "local" / "mod.py").write_text("x = 1\n")
+        (tmp_path / "remote" / "mod.py").write_text("x = 2\n")
+
+        with patch('magic.Magic') as mock_magic:
+            show_text_diffs(["mod.py"], tmp_path / "local", tmp_path / "remote")
+        mock_magic.assert_not_called()
+        assert "+x = 2" in capsys.readouterr().out
+
+    def test_unknown_suffix_uses_mime_detection(self, tmp_path: Path, capsys: pytest.CaptureFixture) -> None:
+        """Fall back to content sniffing for other files and skip binary ones."""
+        (tmp_path / "local").mkdir()
+        (tmp_path / "remote").mkdir()
+        (tmp_path / "local" / "README").write_text("old\n")
+        (tmp_path / "remote" / "README").write_text("new\n")
+        (tmp_path / "local" / "blob.bin").write_bytes(b"\x00\x01\x02\xff" * 64)
+        (tmp_path / "remote" / "blob.bin").write_bytes(b"\x00\x01\x03\xff" * 64)
+
+        show_text_diffs(["README", "blob.bin"], tmp_path / "local", tmp_path / "remote")
+        out = capsys.readouterr().out
+        assert "+new" in out
+        assert "blob.bin" not in out
+
+    def test_does_not_read_binary_files(self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+        """Decide text-ness from the file header and never load the contents of binary files."""
+        for side, last in (("local", b"\x02"), ("remote", b"\x03")):
+            (tmp_path / side).mkdir()
+            (tmp_path / side / "blob.bin").write_bytes(b"\x00\x01\xff" * 64 + last)
+
+        read: list[str] = []
+        real_read_bytes = Path.read_bytes
+
+        def spy(path: Path) -> bytes:
+            read.append(path.name)
+            return real_read_bytes(path)
+
+        monkeypatch.setattr(Path, "read_bytes", spy)
+        show_text_diffs(["blob.bin"], tmp_path / "local", tmp_path / "remote")
+        assert read == []
+
+    def test_non_utf8_text(self, tmp_path: Path, capsys: pytest.CaptureFixture) -> None:
+        """Diff suffix-matched files that are not valid UTF-8 instead of aborting."""
+        (tmp_path / "local").mkdir()
+        (tmp_path / "remote").mkdir()
+        (tmp_path / "local" / "main.c").write_bytes("/* caf\xe9 */\nint x = 1;\n".encode("latin-1"))
+        (tmp_path / "remote" / "main.c").write_bytes("/* caf\xe9 */\nint x = 2;\n".encode("latin-1"))
+
+        show_text_diffs(["main.c"], tmp_path / "local", tmp_path / "remote")
+        out = capsys.readouterr().out
+        assert "-int x = 1;" in out
+        assert "+int x = 2;" in out
+
+    def test_ignores_line_ending_style(self, tmp_path: Path, capsys: pytest.CaptureFixture) -> None:
+        """Compare CRLF and LF files line by line rather than reporting stray carriage returns."""
+        (tmp_path / "local").mkdir()
+        (tmp_path / "remote").mkdir()
+        (tmp_path / "local" / "notes.txt").write_bytes(b"same\r\nold\r\n")
+        (tmp_path / "remote" / "notes.txt").write_bytes(b"same\nnew\n")
+
+        show_text_diffs(["notes.txt"], tmp_path / "local", tmp_path / "remote")
+        lines = capsys.readouterr().out.splitlines()
+        assert "-old" in lines
+        assert "+new" in lines
+        assert "-same" not in lines
+
+    def test_reads_tarball_in_memory(self, tmp_path: Path, capsys: pytest.CaptureFixture) -> None:
+        """Diff a member of a .gz tarball against a directory without extracting it."""
+        (tmp_path / "notes.txt").write_text("old line\n")
+        archive = tmp_path / "snapshot.tar.gz"
+        with tarfile.open(archive, "w:gz") as tar:
+            tar.add(tmp_path / "notes.txt", arcname="notes.txt")
+        (tmp_path / "dir").mkdir()
+        (tmp_path / "dir" / "notes.txt").write_text("new line\n")
+
+        show_text_diffs(["notes.txt"], archive, tmp_path / "dir")
+        out = capsys.readouterr().out
+        assert "-old line" in out
+        assert "+new line" in out
+
+    def test_skips_files_missing_on_one_side(self, tmp_path: Path, capsys: pytest.CaptureFixture) -> None:
+        """Skip changed entries that do not exist as files on both sides."""
+        (tmp_path / "local").mkdir()
+        (tmp_path / "remote").mkdir()
+        (tmp_path / "local" / "new.txt").write_text("only local\n")
+
+        show_text_diffs(["new.txt"], tmp_path / "local", tmp_path / "remote")
+        assert capsys.readouterr().out == ""
+
+
+class TestFilterArgs:
+    """Tests for filter_args function."""
+
+    def test_no_patterns(self) -> None:
+        """Add no arguments when there are no patterns."""
+        assert filter_args([], []) == []
+
+    def test_writes_pattern_files(self) -> None:
+        """Pass patterns through files, with includes ahead of excludes."""
+        args = filter_args(['keep.pyc'], ['*.pyc', '__pycache__'])
+        assert len(args) == 2
+        include_opt, include_file = args[0].split('=', 1)
+        exclude_opt, exclude_file = args[1].split('=', 1)
+        assert include_opt == '--include-from'
+        assert exclude_opt == '--exclude-from'
+        assert Path(include_file).read_text().splitlines() == ['keep.pyc']
+        assert Path(exclude_file).read_text().splitlines() == ['*.pyc', '__pycache__']
+
+    def test_non_string_patterns(self) -> None:
+        """Accept patterns that YAML parsed as numbers, such as 404."""
+        (exclude,) = filter_args([], [404, 'a.txt'])
+        exclude_file = exclude.split('=', 1)[1]
+        assert Path(exclude_file).read_text().splitlines() == ['404', 'a.txt']
+
+    def test_escapes_comment_characters(self) -> None:
+        """Keep patterns starting with '#' or ';' from being read as comments in the pattern file."""
+        (exclude,) = filter_args([], ['#*#', ';notes', 'a#b'])
+        exclude_file = exclude.split('=', 1)[1]
+        assert Path(exclude_file).read_text().splitlines() == ['[#]*#', '[;]notes', 'a#b']
+
 
 class TestResolveRemote:
     """Tests for resolve_remote function."""
@@ -199,6 +564,13 @@ class TestConfig:
         assert config.includes == []
         assert config.dry_run is False
 
+    def test_uses_slots(self) -> None:
+        """Config has no per-instance __dict__ and rejects unknown attributes."""
+        config = Config()
+        assert not hasattr(config, '__dict__')
+        with pytest.raises(AttributeError):
+            config.nonexistent = 'value'
+
     def test_update_from_dict(self) -> None:
         """Update config from dictionary."""
         config = Config()
@@ -216,6 +588,202 @@ class TestConfig:
         config = Config()
         config.update({'nonexistent': 'value'})
         # Should not raise, just ignore
+        assert not hasattr(config, 'nonexistent')
+
+    def test_update_skips_falsy_values(self) -> None:
+        """Empty or false values leave the current setting in place."""
+        config = Config(remotes={'server': 'host:/path'}, dry_run=True)
+        config.update({'remotes': None, 'dry_run': False})
+        assert config.remotes == {'server': 'host:/path'}
+        assert config.dry_run is True
+
+
+class TestPush:
+    """Tests for push function (rsync calls are mocked)."""
+
+    @pytest.fixture
+    def run_command(self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> MagicMock:
+        """Run from tmp_path and record commands instead of executing them."""
+        monkeypatch.chdir(tmp_path)
+        mock = MagicMock(return_value=subprocess.CompletedProcess([], 0))
+        monkeypatch.setattr('tsync.cli.run_command', mock)
+        return mock
+
+    def test_pushes_to_every_target(self, tmp_path: Path, run_command: MagicMock) -> None:
+        """Run one rsync per target, each ending with that target's path."""
+        remotes = {'a': '/backup/a', 'b': 'host:/backup/b'}
+        assert push([], ['all'], remotes, tmp_path, Path('.'), ['-a']) == 0
+
+        destinations = sorted(call.args[0][-1] for call in run_command.call_args_list)
+        assert destinations == ['/backup/a/', 'host:/backup/b/']
+
+    def test_mirrors_relative_path(self, tmp_path: Path, run_command: MagicMock) -> None:
+        """Append the given relative path to the remote root."""
+        push([], ['a'], {'a': 'host:/backup'}, tmp_path, Path('src/pkg'), [])
+        assert run_command.call_args.args[0][-1] == 'host:/backup/src/pkg/'
+
+    def test_returns_first_failure(self, tmp_path: Path, run_command: MagicMock) -> None:
+        """Report the exit status of the first failed target in target order."""
+        codes = {'/backup/a/': 0, '/backup/b/': 23, '/backup/c/': 12}
+        run_command.side_effect = lambda cmd, **kwargs: subprocess.CompletedProcess(cmd, codes[cmd[-1]])
+        remotes = {'a': '/backup/a', 'b': '/backup/b', 'c': '/backup/c'}
+
+        assert push([], ['a', 'b', 'c'], remotes, tmp_path, Path('.'), []) == 23
+
+    def test_single_target_streams_output(self, tmp_path: Path, run_command: MagicMock) -> None:
+        """Let a lone push echo its command and stream rsync's progress directly."""
+        push([], ['a'], {'a': '/backup/a'}, tmp_path, Path('.'), [])
+        assert run_command.call_args.kwargs == {}
+
+    def test_several_targets_print_in_order(self, tmp_path: Path, run_command: MagicMock,
+                                            capsys: pytest.CaptureFixture) -> None:
+        """Capture each push and print its output under the target name, in target order."""
+        def rsync(cmd, **kwargs):
+            assert kwargs == {'capture_output': True, 'echo': False}
+            if cmd[-1] == '/backup/a/':
+                time.sleep(0.05)  # finish after b
+            return subprocess.CompletedProcess(cmd, 0, stdout=f"sent to {cmd[-1]}\n", stderr="")
+
+        run_command.side_effect = rsync
+        push([], ['a', 'b'], {'a': '/backup/a', 'b': '/backup/b'}, tmp_path, Path('.'), [])
+
+        out = capsys.readouterr().out
+        assert out.index("a:") < out.index("sent to /backup/a/") < out.index("b:") < out.index("sent to /backup/b/")
+
+    def test_unknown_target_runs_nothing(self, tmp_path: Path, run_command: MagicMock) -> None:
+        """Reject unknown targets before pushing to any of them."""
+        with pytest.raises(RuntimeError):
+            push([], ['a', 'missing'], {'a': '/backup/a'}, tmp_path, Path('.'), [])
+        run_command.assert_not_called()
+
+
+class TestMain:
+    """Tests for running the CLI in-process through main (rsync calls are mocked)."""
+
+    @pytest.fixture
+    def run_command(self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> MagicMock:
+        """Run from a project in tmp_path and record commands instead of executing them."""
+        monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+        (tmp_path / "project").mkdir()
+        (tmp_path / "project" / ".tsync.yaml").write_text("remotes:\n  backup: /backup\n")
+        monkeypatch.chdir(tmp_path / "project")
+        mock = MagicMock(return_value=subprocess.CompletedProcess([], 0))
+        monkeypatch.setattr('tsync.cli.run_command', mock)
+        return mock
+
+    def test_push_returns_zero(self, run_command: MagicMock) -> None:
+        """Return 0 after a successful push."""
+        assert main(['push', 'backup', '-y']) == 0
+        assert run_command.call_args.args[0][-1] == '/backup/'
+
+    def test_local_remote_skips_ssh_setup(self, run_command: MagicMock, monkeypatch: pytest.MonkeyPatch) -> None:
+        """Do not build ssh options, or need a writable home, when no remote is on another host."""
+        monkeypatch.setenv("HOME", "/proc/nonexistent")
+        ssh_options.cache_clear()
+        try:
+            assert main(['push', 'backup', '-y']) == 0
+        finally:
+            ssh_options.cache_clear()
+        assert '-e' not in run_command.call_args.args[0]
+
+    def test_pull_returns_rsync_status(self, run_command: MagicMock) -> None:
+        """Return rsync's exit status when a pull fails, as for push."""
+        run_command.return_value = subprocess.CompletedProcess([], 23)
+        assert main(['pull', 'backup', '-y']) == 23
+
+    def test_diff_copy_keeps_quotes_in_names(self, run_command: MagicMock, monkeypatch: pytest.MonkeyPatch) -> None:
+        """Fetch changed files under their exact names, including leading or trailing quotes."""
+        run_command.side_effect = [
+            subprocess.CompletedProcess([], 0, stdout=b'.d..t...... ./\n>fcs....... "quoted"\n>fcs....... plain.txt\n'),
+            subprocess.CompletedProcess([], 0),
+        ]
+        monkeypatch.setattr('tsync.cli.show_text_diffs', MagicMock())
+
+        assert main(['diff', 'backup', '--copy']) == 1
+        assert '--out-format=%i %f' in run_command.call_args_list[0].args[0]
+        fetch = run_command.call_args_list[1].args[0]
+        assert '/backup/./"quoted"' in fetch
+        assert '/backup/./plain.txt' in fetch
+
+    def test_diff_copy_lists_local_only_files(self, run_command: MagicMock, monkeypatch: pytest.MonkeyPatch,
+                                             capsys: pytest.CaptureFixture) -> None:
+        """Report files missing on the remote separately and do not try to fetch them."""
+        run_command.return_value = subprocess.CompletedProcess([], 0, stdout=b'>f+++++++++ new.txt\n')
+        monkeypatch.setattr('tsync.cli.show_text_diffs', MagicMock())
+
+        assert main(['diff', 'backup', '--copy']) == 1
+        assert run_command.call_count == 1
+        out = capsys.readouterr().out
+        assert "LOCAL ONLY: new.txt" in out
+        assert "CHANGED" not in out
+
+    def test_diff_copy_reports_rsync_failure(self, run_command: MagicMock, capsys: pytest.CaptureFixture) -> None:
+        """Return rsync's status and show its error instead of reporting the tree as clean."""
+        run_command.return_value = subprocess.CompletedProcess([], 255, stdout=b'', stderr=b'host unreachable\n')
+
+        assert main(['diff', 'backup', '--copy']) == 255
+        captured = capsys.readouterr()
+        assert "host unreachable" in captured.err
+        assert "Clean!" not in captured.out
+
+    def test_push_returns_rsync_status(self, run_command: MagicMock) -> None:
+        """Return rsync's exit status instead of exiting when a push fails."""
+        run_command.return_value = subprocess.CompletedProcess([], 23)
+        assert main(['push', 'backup', '-y']) == 23
+
+
+class TestSshOptions:
+    """Tests for SSH connection multiplexing options."""
+
+    @pytest.fixture(autouse=True)
+    def home(self, monkeypatch: pytest.MonkeyPatch):
+        """Point the home directory at a short temporary path and reset the memoized options."""
+        # pytest's tmp_path is too long to hold a control socket
+        with tempfile.TemporaryDirectory(dir="/tmp") as home:
+            monkeypatch.setenv("HOME", home)
+            ssh_options.cache_clear()
+            yield Path(home)
+            ssh_options.cache_clear()
+
+    def test_control_master(self, home: Path) -> None:
+        """Enable ControlMaster with a short socket path in ~/.ssh."""
+        options = ssh_options()
+        assert 'ControlMaster=auto' in options
+        assert f'ControlPath={home}/.ssh/cm-%C' in options
+        assert (home / ".ssh").is_dir()
+
+    def test_no_multiplexing_without_socket_dir(self, home: Path) -> None:
+        """Fall back to plain connections when the socket directory cannot be created."""
+        (home / ".ssh").write_text("not a directory")
+        assert ssh_options() == ()
+        assert rsync_ssh_args() == []
+
+    def test_no_multiplexing_with_long_home(self, home: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+        """Fall back to plain connections when the socket path would exceed the sun_path limit."""
+        monkeypatch.setenv("HOME", str(home / ("x" * 60)))
+        assert ssh_options() == ()
+
+    def test_rsync_remote_shell(self) -> None:
+        """Pass the same options to rsync as a single -e argument."""
+        flag, shell = rsync_ssh_args()
+        assert flag == '-e'
+        assert shell.split()[0] == 'ssh'
+        assert shell.split()[1:] == list(ssh_options())
+
+
+class TestImports:
+    """Tests for module import behavior."""
+
+    def test_heavy_modules_are_lazy(self) -> None:
+        """Importing the CLI does not load modules only needed to diff, run commands or parse config and arguments."""
+        code = (
+            "import sys, tsync.cli; "
+            "print(sorted(m for m in ('argparse', 'difflib', 'magic', 'ruamel.yaml', 'subprocess', 'tarfile', "
+            "'tempfile') if m in sys.modules))"
+        )
+        result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+        assert result.returncode == 0, result.stderr
+        assert result.stdout.strip() == "[]"
 
 
 class TestParseArgs:
@@ -242,6 +810,18 @@ class TestParseArgs:
             assert args.mode == 'diff'
             assert args.remote == 'server'
 
+    def test_repeated_parses_are_independent(self) -> None:
+        """Reusing the cached parser does not carry values over between calls."""
+        with patch('sys.argv', ['tsync', 'push', 'server', '-y', '-e', '*.log']):
+            args, _ = parse_args()
+            assert args.no_confirm is True
+            assert args.excludes == ['*.log']
+
+        with patch('sys.argv', ['tsync', 'push', 'server']):
+            args, _ = parse_args()
+            assert args.no_confirm is False
+            assert args.excludes == []
+
     def test_global_options(self) -> None:
         """Parse global options before subcommand."""
         with patch('sys.argv', ['tsync', '-y', '-d', 'push', 'server']):
@@ -249,6 +829,23 @@ class TestParseArgs:
             assert args.no_confirm is True
             assert args.dry_run is True
 
+    def test_global_options_after_subcommand(self) -> None:
+        """Parse global options given after the subcommand and its positionals."""
+        with patch('sys.argv', ['tsync', 'push', 'server', '-y', '--delete']):
+            args, extra = parse_args()
+            assert args.target == ['server']
+            assert args.no_confirm is True
+            assert args.delete is True
+            assert args.dry_run is False
+            assert extra == []
+
+    def test_global_options_on_both_sides(self) -> None:
+        """Keep options given before the subcommand when others follow it."""
+        with patch('sys.argv', ['tsync', '-y', 'pull', 'server', '-d']):
+            args, _ = parse_args()
+            assert args.no_confirm is True
+            assert args.dry_run is True
+
     def test_extra_args_passthrough(self) -> None:
         """Pass unrecognized args through for rsync."""
         with patch('sys.argv', ['tsync', 'push', 'server', '--bwlimit=1000']):
@@ -260,13 +857,35 @@ class TestParseArgs:
 # Run with: pytest tests/ -m integration
 
 
+def _bulk_write(root: Path, entries: dict[str, str | bytes]) -> None:
+    """Create files below root from a {relative path: contents} mapping, making parent directories as needed."""
+    made: set[Path] = set()
+    for relpath, contents in entries.items():
+        path = root / relpath
+        if path.parent not in made:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            made.add(path.parent)
+        view = memoryview(contents.encode() if isinstance(contents, str) else contents)
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            while view:
+                view = view[os.write(fd, view):]
+        finally:
+            os.close(fd)
+
+
 @pytest.mark.integration
 class TestIntegration:
     """Integration tests using local paths only (no SSH)."""
 
+    @pytest.fixture(autouse=True)
+    def cache_home(self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+        """Keep the config cache of in-process runs out of the user's cache directory."""
+        monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+
     def test_push_to_local_path(self, tmp_path: Path) -> None:
         """
-        Test pushing current directory to a local backup path.
+        Test pushing current directory to a local backup path, running the CLI as a subprocess.
 
         Directory structure before:
             tmp_path/
@@ -287,17 +906,13 @@ class TestIntegration:
                     └── nested.txt
         """
         project = tmp_path / "project"
-        project.mkdir()
-        (project / "file.txt").write_text("hello")
-        subdir = project / "subdir"
-        subdir.mkdir()
-        (subdir / "nested.txt").write_text("nested content")
-
         backup = tmp_path / "backup"
         backup.mkdir()
-
-        config = project / ".tsync.yaml"
-        config.write_text(f"remotes:\n  backup: {backup}\n")
+        _bulk_write(project, {
+            ".tsync.yaml": f"remotes:\n  backup: {backup}\n",
+            "file.txt": "hello",
+            "subdir/nested.txt": "nested content",
+        })
 
         # Run the CLI
         result = subprocess.run(
@@ -313,7 +928,7 @@ class TestIntegration:
         assert (backup / "subdir" / "nested.txt").exists()
         assert (backup / "subdir" / "nested.txt").read_text() == "nested content"
 
-    def test_pull_from_local_path(self, tmp_path: Path) -> None:
+    def test_pull_from_local_path(self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
         """
         Test pulling from a local backup path.
 
@@ -337,31 +952,20 @@ class TestIntegration:
                 └── ...
         """
         project = tmp_path / "project"
-        project.mkdir()
-
         backup = tmp_path / "backup"
-        backup.mkdir()
-        (backup / "file.txt").write_text("from backup")
-        subdir = backup / "subdir"
-        subdir.mkdir()
-        (subdir / "nested.txt").write_text("nested from backup")
-
-        config = project / ".tsync.yaml"
-        config.write_text(f"remotes:\n  backup: {backup}\n")
-
-        result = subprocess.run(
-            [sys.executable, "-m", "tsync.cli", "pull", "backup", "-y"],
-            cwd=project,
-            capture_output=True,
-            text=True,
-        )
+        _bulk_write(backup, {
+            "file.txt": "from backup",
+            "subdir/nested.txt": "nested from backup",
+        })
+        _bulk_write(project, {".tsync.yaml": f"remotes:\n  backup: {backup}\n"})
 
-        assert result.returncode == 0, f"Pull failed: {result.stderr}"
+        monkeypatch.chdir(project)
+        assert main(["pull", "backup", "-y"]) == 0
         assert (project / "file.txt").exists()
         assert (project / "file.txt").read_text() == "from backup"
         assert (project / "subdir" / "nested.txt").exists()
 
-    def test_push_respects_excludes(self, tmp_path: Path) -> None:
+    def test_push_respects_excludes(self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
         """
         Test that excludes in config are respected.
 
@@ -375,32 +979,20 @@ class TestIntegration:
             └── backup/
         """
         project = tmp_path / "project"
-        project.mkdir()
-        (project / "keep.txt").write_text("keep me")
-        cache = project / "__pycache__"
-        cache.mkdir()
-        (cache / "cache.pyc").write_text("ignore me")
-
         backup = tmp_path / "backup"
         backup.mkdir()
+        _bulk_write(project, {
+            ".tsync.yaml": f"remotes:\n  backup: {backup}\nexcludes:\n  - __pycache__\n",
+            "keep.txt": "keep me",
+            "__pycache__/cache.pyc": "ignore me",
+        })
 
-        config = project / ".tsync.yaml"
-        config.write_text(
-            f"remotes:\n  backup: {backup}\nexcludes:\n  - __pycache__\n"
-        )
-
-        result = subprocess.run(
-            [sys.executable, "-m", "tsync.cli", "push", "backup", "-y"],
-            cwd=project,
-            capture_output=True,
-            text=True,
-        )
-
-        assert result.returncode == 0
+        monkeypatch.chdir(project)
+        assert main(["push", "backup", "-y"]) == 0
         assert (backup / "keep.txt").exists()
         assert not (backup / "__pycache__").exists()
 
-    def test_push_from_subdirectory(self, tmp_path: Path) -> None:
+    def test_push_from_subdirectory(self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
         """
         Test pushing from a subdirectory preserves relative path.
 
@@ -419,54 +1011,37 @@ class TestIntegration:
                     └── module.py      <- preserves src/ prefix
         """
         project = tmp_path / "project"
-        project.mkdir()
         src = project / "src"
-        src.mkdir()
-        (src / "module.py").write_text("print('hello')")
-
         backup = tmp_path / "backup"
         backup.mkdir()
-
-        config = project / ".tsync.yaml"
-        config.write_text(f"remotes:\n  backup: {backup}\n")
+        _bulk_write(project, {
+            ".tsync.yaml": f"remotes:\n  backup: {backup}\n",
+            "src/module.py": "print('hello')",
+        })
 
         # Push from subdirectory
-        result = subprocess.run(
-            [sys.executable, "-m", "tsync.cli", "push", "backup", "-y"],
-            cwd=src,  # Run from src/ subdirectory
-            capture_output=True,
-            text=True,
-        )
-
-        assert result.returncode == 0, f"Push failed: {result.stderr}"
+        monkeypatch.chdir(src)
+        assert main(["push", "backup", "-y"]) == 0
         # File should be at backup/src/module.py, preserving the relative path
         assert (backup / "src" / "module.py").exists()
         assert (backup / "src" / "module.py").read_text() == "print('hello')"
 
-    def test_dry_run_does_not_sync(self, tmp_path: Path) -> None:
+    def test_dry_run_does_not_sync(self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
         """Test that --dry-run shows commands but doesn't sync files."""
         project = tmp_path / "project"
-        project.mkdir()
-        (project / "file.txt").write_text("content")
-
         backup = tmp_path / "backup"
         backup.mkdir()
+        _bulk_write(project, {
+            ".tsync.yaml": f"remotes:\n  backup: {backup}\n",
+            "file.txt": "content",
+        })
 
-        config = project / ".tsync.yaml"
-        config.write_text(f"remotes:\n  backup: {backup}\n")
-
-        result = subprocess.run(
-            [sys.executable, "-m", "tsync.cli", "push", "backup", "-y", "-d"],
-            cwd=project,
-            capture_output=True,
-            text=True,
-        )
-
-        assert result.returncode == 0
+        monkeypatch.chdir(project)
+        assert main(["push", "backup", "-y", "-d"]) == 0
         # File should NOT exist because it was a dry run
         assert not (backup / "file.txt").exists()
 
-    def test_push_specific_file_with_f_flag(self, tmp_path: Path) -> None:
+    def test_push_specific_file_with_f_flag(self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
         """
         Test pushing only a specific file using -f flag.
 
@@ -484,30 +1059,21 @@ class TestIntegration:
                 └── sync_me.txt       <- only this file
         """
         project = tmp_path / "project"
-        project.mkdir()
-        (project / "sync_me.txt").write_text("sync this")
-        (project / "ignore_me.txt").write_text("ignore this")
-
         backup = tmp_path / "backup"
         backup.mkdir()
+        _bulk_write(project, {
+            ".tsync.yaml": f"remotes:\n  backup: {backup}\n",
+            "sync_me.txt": "sync this",
+            "ignore_me.txt": "ignore this",
+        })
 
-        config = project / ".tsync.yaml"
-        config.write_text(f"remotes:\n  backup: {backup}\n")
-
-        result = subprocess.run(
-            [sys.executable, "-m", "tsync.cli", "push", "backup", "-y",
-             "-f", "sync_me.txt"],
-            cwd=project,
-            capture_output=True,
-            text=True,
-        )
-
-        assert result.returncode == 0, f"Push failed: {result.stderr}"
+        monkeypatch.chdir(project)
+        assert main(["push", "backup", "-y", "-f", "sync_me.txt"]) == 0
         assert (backup / "sync_me.txt").exists()
         assert (backup / "sync_me.txt").read_text() == "sync this"
         assert not (backup / "ignore_me.txt").exists()
 
-    def test_push_specific_folder_with_f_flag(self, tmp_path: Path) -> None:
+    def test_push_specific_folder_with_f_flag(self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
         """
         Test pushing only a specific folder using -f flag.
 
@@ -529,33 +1095,22 @@ class TestIntegration:
                     └── b.txt
         """
         project = tmp_path / "project"
-        project.mkdir()
-        (project / "root.txt").write_text("root file")
-        subdir = project / "subdir"
-        subdir.mkdir()
-        (subdir / "a.txt").write_text("file a")
-        (subdir / "b.txt").write_text("file b")
-
         backup = tmp_path / "backup"
         backup.mkdir()
+        _bulk_write(project, {
+            ".tsync.yaml": f"remotes:\n  backup: {backup}\n",
+            "root.txt": "root file",
+            "subdir/a.txt": "file a",
+            "subdir/b.txt": "file b",
+        })
 
-        config = project / ".tsync.yaml"
-        config.write_text(f"remotes:\n  backup: {backup}\n")
-
-        result = subprocess.run(
-            [sys.executable, "-m", "tsync.cli", "push", "backup", "-y",
-             "-f", "subdir"],
-            cwd=project,
-            capture_output=True,
-            text=True,
-        )
-
-        assert result.returncode == 0, f"Push failed: {result.stderr}"
+        monkeypatch.chdir(project)
+        assert main(["push", "backup", "-y", "-f", "subdir"]) == 0
         assert not (backup / "root.txt").exists()
         assert (backup / "subdir" / "a.txt").exists()
         assert (backup / "subdir" / "b.txt").exists()
 
-    def test_pull_specific_file_with_f_flag(self, tmp_path: Path) -> None:
+    def test_pull_specific_file_with_f_flag(self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
         """
         Test pulling only a specific file using -f flag.
 
@@ -576,25 +1131,15 @@ class TestIntegration:
                 └── ...
         """
         project = tmp_path / "project"
-        project.mkdir()
-
         backup = tmp_path / "backup"
-        backup.mkdir()
-        (backup / "wanted.txt").write_text("wanted content")
-        (backup / "unwanted.txt").write_text("unwanted content")
-
-        config = project / ".tsync.yaml"
-        config.write_text(f"remotes:\n  backup: {backup}\n")
-
-        result = subprocess.run(
-            [sys.executable, "-m", "tsync.cli", "pull", "backup", "-y",
-             "-f", "wanted.txt"],
-            cwd=project,
-            capture_output=True,
-            text=True,
-        )
+        _bulk_write(backup, {
+            "wanted.txt": "wanted content",
+            "unwanted.txt": "unwanted content",
+        })
+        _bulk_write(project, {".tsync.yaml": f"remotes:\n  backup: {backup}\n"})
 
-        assert result.returncode == 0, f"Pull failed: {result.stderr}"
+        monkeypatch.chdir(project)
+        assert main(["pull", "backup", "-y", "-f", "wanted.txt"]) == 0
         assert (project / "wanted.txt").exists()
         assert (project / "wanted.txt").read_text() == "wanted content"
         assert not (project / "unwanted.txt").exists()